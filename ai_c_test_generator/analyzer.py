@@ -6,28 +6,92 @@ import os
 import re
 from typing import List, Dict, Set
 
+# Build, output and tooling directories never searched for sources (hidden directories are
+# skipped too); shared with the CLI's source discovery so both walk the same tree
+SKIP_DIRS = frozenset({
+    'build', 'cmake-build', 'cmake-build-debug', 'tests', 'node_modules', 'temp', 'tmp', '__pycache__',
+})
+
+# Source files larger than this are neither generated for nor validated; shared by the
+# generator and the validator so a source is either skipped up front or validated normally
+MAX_SOURCE_BYTES = 512000
+
 
 class DependencyAnalyzer:
     """Analyzes C file dependencies and function relationships"""
 
     def __init__(self, repo_path: str):
         self.repo_path = os.path.abspath(repo_path)
+        # file_path -> (st_mtime_ns, functions), shared by every lookup made through this analyzer
+        self._functions_cache = {}
+        # file_path -> (st_mtime_ns, analysis), so regenerations and batches do not re-parse the file
+        self._analysis_cache = {}
+        # Source file list, discovered once per analyzer (tests are written outside src/)
+        self._c_files = None
 
     def analyze_file_dependencies(self, target_file: str) -> Dict:
-        """Comprehensive dependency analysis for any C file"""
+        """Comprehensive dependency analysis for any C file, reused while the file is unchanged"""
+        try:
+            stamp = os.stat(target_file).st_mtime_ns
+        except OSError:
+            stamp = None
+
+        cached = self._analysis_cache.get(target_file)
+        if cached is not None and stamp is not None and cached[0] == stamp:
+            analysis = cached[1]
+        else:
+            # Read once and share the text with every pass (and with callers, as 'source')
+            try:
+                with open(target_file, 'r', encoding='utf-8', errors='replace') as f:
+                    source = f.read()
+            except Exception:
+                source = None
+
+            includes = self._extract_includes(target_file, source)
+            analysis = {
+                'file_path': target_file,
+                'source': source,
+                'functions': self._extract_functions(target_file),
+                'includes': includes,
+                'called_functions': self._find_called_functions(target_file, source),
+                'file_dependencies': self._find_file_dependencies(target_file, includes)
+            }
+            if stamp is not None:
+                self._analysis_cache[target_file] = (stamp, analysis)
+
+        # Hand out copies so callers can modify the result without touching the cache
         return {
-            'file_path': target_file,
-            'functions': self._extract_functions(target_file),
-            'includes': self._extract_includes(target_file),
-            'called_functions': self._find_called_functions(target_file),
-            'file_dependencies': self._find_file_dependencies(target_file)
+            'file_path': analysis['file_path'],
+            'source': analysis['source'],
+            'functions': [dict(func) for func in analysis['functions']],
+            'includes': list(analysis['includes']),
+            'called_functions': set(analysis['called_functions']),
+            'file_dependencies': list(analysis['file_dependencies'])
         }
 
     def _extract_functions(self, file_path: str) -> List[Dict]:
+        """Extract function signatures, reusing earlier results while the file is unchanged"""
+        try:
+            stamp = os.stat(file_path).st_mtime_ns
+        except OSError:
+            stamp = None
+
+        cached = self._functions_cache.get(file_path)
+        if cached is not None and stamp is not None and cached[0] == stamp:
+            functions = cached[1]
+        else:
+            functions = self._parse_functions(file_path)
+            if stamp is not None:
+                self._functions_cache[file_path] = (stamp, functions)
+
+        # Callers may annotate the returned dicts, so hand out copies
+        return [dict(func) for func in functions]
+
+    def _parse_functions(self, file_path: str) -> List[Dict]:
         """Extract function signatures using regex parsing"""
         functions = []
         try:
-            with open(file_path, 'r') as f:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
                 content = f.read()
 
             # Remove comments and strings for cleaner parsing
@@ -49,45 +113,48 @@ class DependencyAnalyzer:
 
         return functions
 
-    def _extract_includes(self, file_path: str) -> List[str]:
-        """Extract all #include directives"""
+    def _extract_includes(self, file_path: str, content: str = None) -> List[str]:
+        """Extract all #include directives (from content when the caller already read the file)"""
         includes = []
         include_pattern = re.compile(r'^\s*#include\s+[<"]([^>"]+)[>"]', re.MULTILINE)
 
         try:
-            with open(file_path, 'r') as f:
-                content = f.read()
-                includes = include_pattern.findall(content)
+            if content is None:
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    content = f.read()
+            includes = include_pattern.findall(content)
         except Exception:
             pass
 
         return includes
 
-    def _find_called_functions(self, file_path: str) -> Set[str]:
-        """Find all functions called from this file"""
+    def _find_called_functions(self, file_path: str, content: str = None) -> Set[str]:
+        """Find all functions called from this file (from content when the caller already read it)"""
         called_funcs = set()
         func_call_pattern = re.compile(r'\b([a-zA-Z_][a-zA-Z0-9_]*)\s*\(')
 
         try:
-            with open(file_path, 'r') as f:
-                content = f.read()
-                # Remove comments, strings, and keywords
-                content_clean = re.sub(r'//.*?$|/\*.*?\*/|"(?:\\.|[^"\\])*"', '', content, flags=re.MULTILINE|re.DOTALL)
-
-                for match in func_call_pattern.finditer(content_clean):
-                    func_name = match.group(1)
-                    # Skip C keywords and common patterns
-                    if func_name not in ['if', 'while', 'for', 'switch', 'return', 'sizeof', 'printf', 'malloc', 'free'] and not func_name[0].isupper():
-                        called_funcs.add(func_name)
+            if content is None:
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    content = f.read()
+            # Remove comments, strings, and keywords
+            content_clean = re.sub(r'//.*?$|/\*.*?\*/|"(?:\\.|[^"\\])*"', '', content, flags=re.MULTILINE|re.DOTALL)
+
+            for match in func_call_pattern.finditer(content_clean):
+                func_name = match.group(1)
+                # Skip C keywords and common patterns
+                if func_name not in ['if', 'while', 'for', 'switch', 'return', 'sizeof', 'printf', 'malloc', 'free'] and not func_name[0].isupper():
+                    called_funcs.add(func_name)
         except Exception:
             pass
 
         return called_funcs
 
-    def _find_file_dependencies(self, file_path: str) -> List[str]:
+    def _find_file_dependencies(self, file_path: str, includes: List[str] = None) -> List[str]:
         """Find other C files this file depends on"""
         dependencies = set()
-        includes = self._extract_includes(file_path)
+        if includes is None:
+            includes = self._extract_includes(file_path)
 
         for include in includes:
             if include.endswith('.h'):
@@ -110,11 +177,16 @@ class DependencyAnalyzer:
 
     def find_all_c_files(self) -> List[str]:
         """Find all C files in the repository, ONLY processing files under src/ directory"""
+        if self._c_files is None:
+            self._c_files = self._walk_c_files()
+        return list(self._c_files)
+
+    def _walk_c_files(self) -> List[str]:
+        """Walk the repository for C source files under src/"""
         c_files = []
         for root, dirs, files in os.walk(self.repo_path):
             # Skip common build and hidden directories first
-            dirs[:] = [d for d in dirs if not d.startswith('.') and
-                      d not in ['build', 'cmake-build', 'node_modules', 'temp', 'tmp']]
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in SKIP_DIRS]
 
             # Only process files in the src directory (not in build/src)
             root_parts = root.replace('\\', '/').split('/')
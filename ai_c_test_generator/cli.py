@@ -4,28 +4,49 @@ CLI interface for AI C Test Generator
 """
 
 import argparse
+import functools
+import itertools
 import os
+import shutil
 import sys
-from pathlib import Path
+from typing import List, Optional
 
-# Add compatibility for older Python versions
-try:
-    from importlib.metadata import packages_distributions
-except ImportError:
-    # Python < 3.10 compatibility
-    try:
-        from importlib_metadata import packages_distributions
-    except ImportError:
-        # Fallback implementation
-        def packages_distributions():
-            return {}
+from .analyzer import MAX_SOURCE_BYTES, SKIP_DIRS
+
+# Ordering of validator quality ratings, used for threshold comparisons
+_QUALITY_LEVELS = {'low': 0, 'medium': 1, 'high': 2}
 
-from .generator import SmartTestGenerator
-from .validator import TestValidator
+# Two-character file suffixes recognised during source discovery
+_C_EXTS = frozenset(('.c', '.h'))
+_C_ONLY = frozenset(('.c',))
 
 
+def _iter_c_files(root, exts=_C_ONLY):
+    """Recursively yield paths of files under root whose two-character suffix is in exts
+
+    Directories that cannot be listed (permissions, removed mid-scan) are skipped, like os.walk does.
+    """
+    try:
+        entries = os.scandir(root)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                name = entry.name
+                if name[0] != '.' and name not in SKIP_DIRS:
+                    yield from _iter_c_files(entry.path, exts)
+            elif entry.name[-2:] in exts:
+                yield entry.path
+
+
+@functools.lru_cache(maxsize=1)
 def create_parser():
-    """Create argument parser for the CLI tool"""
+    """Create argument parser for the CLI tool (built once and reused across calls)"""
     parser = argparse.ArgumentParser(
         description="AI-powered C unit test generator using Google Gemini",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -88,6 +109,37 @@ Examples:
         version='%(prog)s 1.0.0'
     )
 
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=min(8, (os.cpu_count() or 1) * 2),
+        help='Number of files to generate and validate in parallel (default: min(8, 2 x CPU count))'
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Rebuild the dependency map instead of reusing any cached function data'
+    )
+
+    parser.add_argument(
+        '--force-refresh',
+        action='store_true',
+        help='Call the Gemini API even when a cached response for the same prompt exists'
+    )
+
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='Generate tests for groups of small source files with a single API call'
+    )
+
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Regenerate tests even when the existing test file is newer than its source'
+    )
+
     parser.add_argument(
         '--max-regeneration-attempts',
         type=int,
@@ -118,38 +170,205 @@ Examples:
     return parser
 
 
-def validate_environment(args):
-    """Validate environment and arguments"""
+def validate_environment(args) -> Optional[List[str]]:
+    """Validate environment and arguments, returning the .c files to process (None on failure)"""
     # Check repository path
     if not os.path.exists(args.repo_path):
         print(f"❌ Repository path '{args.repo_path}' does not exist")
-        return False
+        return None
 
     # Check for C files in source directory
-    source_path = os.path.join(args.repo_path, args.source_dir)
+    source_path = args.source_path
     if not os.path.exists(source_path):
         print(f"❌ Source directory '{source_path}' does not exist")
-        return False
+        return None
 
-    # Check for C files
-    c_files = []
-    for root, dirs, files in os.walk(source_path):
-        for file in files:
-            if file.endswith(('.c', '.h')):
-                c_files.append(os.path.join(root, file))
-
-    if not c_files:
+    # Check for C files - stop at the first hit before collecting anything
+    found_files = _iter_c_files(source_path, _C_EXTS)
+    first_file = next(found_files, None)
+    if first_file is None:
         print(f"❌ No C files found in '{source_path}'")
-        return False
+        return None
+
+    # Collect the .c files to process from the rest of the same traversal
+    # (headers only count towards the existence check)
+    c_files = []
+    for file_path in itertools.chain((first_file,), found_files):
+        if not file_path.endswith('.c'):
+            continue
+        # Skip main.c as it's not suitable for unit testing
+        if os.path.basename(file_path) == 'main.c':
+            if args.verbose:
+                print(f"⏭️ Skipping main.c (application entry point)")
+            continue
+        c_files.append(file_path)
 
     # Check API key
     api_key = args.api_key or os.getenv('GEMINI_API_KEY')
     if not api_key:
         print("❌ Set GEMINI_API_KEY environment variable or use --api-key")
         print("   Get your API key from: https://makersuite.google.com/app/apikey")
-        return False
-
-    return True
+        return None
+    # Keep the resolved key so main() does not look it up again
+    args.api_key = api_key
+
+    return c_files
+
+
+def _process_file(file_path, generator, validator, args, output_dir, dependency_map, threshold_quality_level,
+                  initial_result=None):
+    """Generate and validate tests for a single file, regenerating low-quality results.
+
+    Files whose name is shared with another source (args.output_locks) write the same test
+    file, so they hold that name's lock while they are processed.
+    """
+    lock = args.output_locks.get(os.path.basename(file_path))
+    if lock is None:
+        return _generate_and_validate(
+            file_path, generator, validator, args, output_dir, dependency_map, threshold_quality_level, initial_result
+        )
+    with lock:
+        return _generate_and_validate(
+            file_path, generator, validator, args, output_dir, dependency_map, threshold_quality_level, initial_result
+        )
+
+
+def _generate_and_validate(file_path, generator, validator, args, output_dir, dependency_map, threshold_quality_level,
+                           initial_result=None):
+    """Generate and validate tests for a single file, regenerating low-quality results.
+
+    initial_result, when given, stands in for the first generation attempt (see _process_batch).
+
+    Returns (final_result, final_validation, regenerations, attempts, output_lines); for a skipped
+    file final_result is the generator's result with its 'skipped' reason. Output is
+    buffered so each file's log is written in one go and stays contiguous under parallelism.
+    """
+    lines = []
+    log = lines.append
+
+    # Files under repo_path just drop its prefix; a --source-dir outside it needs relpath
+    if file_path.startswith(args.repo_prefix):
+        rel_path = file_path[len(args.repo_prefix):]
+    else:
+        rel_path = os.path.relpath(file_path, args.repo_path)
+    log(f"🎯 Processing: {rel_path}")
+
+    max_attempts = args.max_regeneration_attempts + 1  # +1 for initial generation
+    attempt = 0
+    regenerations = 0
+    final_result = None
+    final_validation = None
+
+    while attempt < max_attempts:
+        # Stop before another (re)generation once the run is interrupted
+        if args.stop_event.is_set():
+            log("   ⏹️  Cancelled")
+            break
+        attempt += 1
+        try:
+            # Generate tests for this file
+            if attempt == 1 and initial_result is not None:
+                result = initial_result
+            else:
+                result = generator.generate_tests_for_file(
+                    file_path, args.repo_path, output_dir, dependency_map, final_validation if attempt > 1 else None,
+                    log=log
+                )
+
+            if not result['success']:
+                log(f"   ❌ Generation failed: {result['error']}")
+                break
+            if result.get('skipped'):
+                log(f"   ⏭️  Skipped: {result['skipped']}")
+                return result, None, 0, attempt, lines
+            if result.get('cached') and args.verbose:
+                log("   ⏭️  Test is up to date, skipping generation")
+
+            # Validate the generated test
+            if args.verbose:
+                log(f"   🔍 Validating (attempt {attempt})...")
+            validation_result = validator.validate_test_file(result['test_file'], file_path)
+            if validation_result['quality'] == 'Low':
+                # Don't let a later run replay the response that produced this test
+                generator.discard_cached_response(result)
+
+            # Check if regeneration is needed based on quality threshold
+            current_quality_level = _QUALITY_LEVELS.get(validation_result['quality'].lower(), 0)
+
+            needs_regeneration = (
+                args.regenerate_on_low_quality and
+                current_quality_level < threshold_quality_level and
+                attempt < max_attempts
+            )
+
+            # Print validation summary
+            status = "✅" if validation_result['compiles'] and validation_result['realistic'] else "⚠️"
+            quality = validation_result['quality']
+            compiles = 'Compiles' if validation_result['compiles'] else 'Broken'
+            realistic = 'Realistic' if validation_result['realistic'] else 'Unrealistic'
+
+            if attempt == 1:
+                log(f"   {status} {quality} quality ({compiles}, {realistic})")
+            else:
+                log(f"   {status} {quality} quality ({compiles}, {realistic}) - regenerated")
+
+            if not validation_result['compiles'] and validation_result['issues']:
+                log(f"   Issues: {len(validation_result['issues'])}")
+                if args.verbose:
+                    for issue in validation_result['issues'][:3]:  # Show first 3 issues
+                        log(f"     - {issue}")
+
+            # Store final results
+            final_result = result
+            final_validation = validation_result
+
+            # Check if we should regenerate
+            if needs_regeneration:
+                log(f"   🔄 Low quality detected, regenerating (attempt {attempt + 1}/{max_attempts})...")
+                regenerations += 1
+                # Remove the low-quality test file so it can be regenerated
+                try:
+                    os.remove(result['test_file'])
+                except FileNotFoundError:
+                    pass
+                continue
+            else:
+                # Quality is acceptable or we've reached max attempts
+                break
+
+        except Exception as e:
+            log(f"   ❌ Error processing {rel_path}: {str(e)}")
+            break
+
+    if final_result and final_result['success']:
+        log(f"   ✅ Final: {os.path.basename(final_result['test_file'])} ({final_validation['quality']} quality)")
+    else:
+        log(f"   ❌ Failed to generate acceptable test for {rel_path}")
+
+    return final_result, final_validation, regenerations, attempt, lines
+
+
+def _process_batch(batch, generator, validator, args, output_dir, dependency_map, threshold_quality_level):
+    """Generate a group of files with one API call, then validate each like _process_file.
+
+    Returns a list with one _process_file result per file in batch.
+    """
+    batch_lines = []
+    initial_results = {}
+    if len(batch) > 1 and not args.stop_event.is_set():
+        initial_results = generator.generate_tests_for_files_batched(
+            batch, args.repo_path, output_dir, dependency_map, log=batch_lines.append
+        )
+    results = [
+        _process_file(
+            file_path, generator, validator, args, output_dir, dependency_map, threshold_quality_level,
+            initial_results.get(file_path)
+        )
+        for file_path in batch
+    ]
+    # Messages from the shared batch call lead the first file's output
+    results[0][4][:0] = batch_lines
+    return results
 
 
 def main():
@@ -157,10 +376,17 @@ def main():
     parser = create_parser()
     args = parser.parse_args()
 
-    if not validate_environment(args):
+    # Resolve frequently used paths once
+    args.source_path = os.path.join(args.repo_path, args.source_dir)
+    args.output_dir = os.path.join(args.repo_path, args.output)
+    args.repo_prefix = args.repo_path.rstrip('/' + os.sep) + os.sep
+
+    c_files = validate_environment(args)
+    if c_files is None:
         sys.exit(1)
 
-    api_key = args.api_key or os.getenv('GEMINI_API_KEY')
+    api_key = args.api_key
+    threshold_quality_level = _QUALITY_LEVELS[args.quality_threshold.lower()]
 
     print("🚀 AI C Test Generator")
     print(f"   Repository: {args.repo_path}")
@@ -168,168 +394,132 @@ def main():
     print(f"   Output dir: {args.output}")
     print()
 
+    # Imported here so --help/--version and argument errors don't pay for the Gemini SDK
+    # or the thread pool machinery
+    import threading
+    from collections import Counter
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    from .generator import SmartTestGenerator
+    from .validator import TestValidator
+
+    # Set on Ctrl-C so workers stop starting generations, retries and regenerations
+    args.stop_event = threading.Event()
+
+    # Files with the same name in different directories write the same tests/test_<name>.c;
+    # each such name gets a lock so those files are processed one at a time and never batched
+    name_counts = Counter(os.path.basename(file_path) for file_path in c_files)
+    args.output_locks = {name: threading.Lock() for name, count in name_counts.items() if count > 1}
+    if args.output_locks:
+        print(f"⚠️ Source files sharing a name write the same test file, processing them one at a time: "
+              f"{', '.join(sorted(args.output_locks))}")
+
     try:
         # Initialize components
-        generator = SmartTestGenerator(api_key, redact_sensitive=args.redact_sensitive)
+        generator = SmartTestGenerator(
+            api_key, redact_sensitive=args.redact_sensitive, force_refresh=args.force_refresh,
+            force=args.force, stop_event=args.stop_event
+        )
         validator = TestValidator(args.repo_path)
 
         # Build dependency map
         if args.verbose:
             print("📋 Building dependency map...")
-        dependency_map = generator.build_dependency_map(args.repo_path)
-
-        # Find C files in source directory (excluding main.c)
-        source_path = os.path.join(args.repo_path, args.source_dir)
-        c_files = []
-        for root, dirs, files in os.walk(source_path):
-            for file in files:
-                if file.endswith('.c'):  # Only process .c files, not headers
-                    # Skip main.c as it's not suitable for unit testing
-                    if file == 'main.c':
-                        if args.verbose:
-                            print(f"⏭️ Skipping main.c (application entry point)")
-                        continue
-                    c_files.append(os.path.join(root, file))
+        dependency_map = generator.build_dependency_map(args.repo_path, use_cache=not args.no_cache)
 
         if args.verbose:
             print(f"📁 Found {len(c_files)} C files to process")
 
         # Create output directory
-        output_dir = os.path.join(args.repo_path, args.output)
+        output_dir = args.output_dir
         os.makedirs(output_dir, exist_ok=True)
 
         # Clean up old compilation reports
         compilation_report_dir = os.path.join(output_dir, "compilation_report")
         if os.path.exists(compilation_report_dir):
             print("🧹 Cleaning up old compilation reports...")
-            try:
-                import shutil
-                shutil.rmtree(compilation_report_dir)
-            except (OSError, PermissionError) as e:
-                print(f"⚠️ Could not clean up old reports: {e}")
-                # Try to remove files individually
-                try:
-                    for root, dirs, files in os.walk(compilation_report_dir, topdown=False):
-                        for file in files:
-                            try:
-                                os.remove(os.path.join(root, file))
-                            except OSError:
-                                pass
-                        for dir_name in dirs:
-                            try:
-                                os.rmdir(os.path.join(root, dir_name))
-                            except OSError:
-                                pass
-                    os.rmdir(compilation_report_dir)
-                except OSError:
-                    print("⚠️ Skipping cleanup due to permission issues")
+            # Let rmtree skip entries it cannot remove instead of aborting the whole cleanup
+            failed_paths = []
+            if sys.version_info >= (3, 12):
+                shutil.rmtree(compilation_report_dir, onexc=lambda func, path, exc: failed_paths.append(path))
+            else:
+                # onerror is deprecated from Python 3.12 on
+                shutil.rmtree(compilation_report_dir, onerror=lambda func, path, exc_info: failed_paths.append(path))
+            if failed_paths:
+                print(f"⚠️ Could not clean up {len(failed_paths)} old report path(s) due to permission issues")
         os.makedirs(compilation_report_dir, exist_ok=True)
 
-        # Process each file
+        # Process files in parallel - generation and validation are dominated by
+        # API latency and are independent across files
         successful_generations = 0
-        validation_reports = []
+        skipped_files = 0
+        too_large_files = 0
+        saved_reports = 0
+        low_quality_tests = []
         regeneration_stats = {'total_regenerations': 0, 'successful_regenerations': 0}
 
-        for file_path in c_files:
-            rel_path = os.path.relpath(file_path, args.repo_path)
-            print(f"🎯 Processing: {rel_path}")
-
-            max_attempts = args.max_regeneration_attempts + 1  # +1 for initial generation
-            attempt = 0
-            final_result = None
-            final_validation = None
-
-            while attempt < max_attempts:
-                attempt += 1
-                try:
-                    # Generate tests for this file
-                    result = generator.generate_tests_for_file(
-                        file_path, args.repo_path, output_dir, dependency_map, final_validation if attempt > 1 else None
-                    )
-
-                    if not result['success']:
-                        print(f"   ❌ Generation failed: {result['error']}")
-                        break
-
-                    # Validate the generated test
-                    if args.verbose:
-                        print(f"   🔍 Validating (attempt {attempt})...")
-                    validation_result = validator.validate_test_file(result['test_file'], file_path)
-
-                    # Check if regeneration is needed based on quality threshold
-                    quality_levels = {'low': 0, 'medium': 1, 'high': 2}
-                    current_quality_level = quality_levels.get(validation_result['quality'].lower(), 0)
-                    threshold_quality_level = quality_levels.get(args.quality_threshold.lower(), 0)
-
-                    needs_regeneration = (
-                        args.regenerate_on_low_quality and
-                        current_quality_level < threshold_quality_level and
-                        attempt < max_attempts
-                    )
-
-                    # Print validation summary
-                    status = "✅" if validation_result['compiles'] and validation_result['realistic'] else "⚠️"
-                    quality = validation_result['quality']
-                    compiles = 'Compiles' if validation_result['compiles'] else 'Broken'
-                    realistic = 'Realistic' if validation_result['realistic'] else 'Unrealistic'
-
-                    if attempt == 1:
-                        print(f"   {status} {quality} quality ({compiles}, {realistic})")
-                    else:
-                        print(f"   {status} {quality} quality ({compiles}, {realistic}) - regenerated")
-
-                    if not validation_result['compiles'] and validation_result['issues']:
-                        print(f"   Issues: {len(validation_result['issues'])}")
-                        if args.verbose:
-                            for issue in validation_result['issues'][:3]:  # Show first 3 issues
-                                print(f"     - {issue}")
-
-                    # Store final results
-                    final_result = result
-                    final_validation = validation_result
-
-                    # Check if we should regenerate
-                    if needs_regeneration:
-                        print(f"   🔄 Low quality detected, regenerating (attempt {attempt + 1}/{max_attempts})...")
-                        regeneration_stats['total_regenerations'] += 1
-                        # Remove the low-quality test file so it can be regenerated
-                        if os.path.exists(result['test_file']):
-                            os.remove(result['test_file'])
-                        continue
-                    else:
-                        # Quality is acceptable or we've reached max attempts
-                        break
-
-                except Exception as e:
-                    print(f"   ❌ Error processing {rel_path}: {str(e)}")
-                    break
-
-            # Process final result
-            if final_result and final_result['success']:
-                successful_generations += 1
-                validation_reports.append(final_validation)
-
-                # Track successful regenerations
-                if attempt > 1:
-                    regeneration_stats['successful_regenerations'] += 1
-
-                print(f"   ✅ Final: {os.path.basename(final_result['test_file'])} ({final_validation['quality']} quality)")
-            else:
-                print(f"   ❌ Failed to generate acceptable test for {rel_path}")
-
-        # Save validation reports
-        if validation_reports:
-            print(f"\n📊 Saving validation reports...")
-            report_dir = os.path.join(args.repo_path, args.output, "compilation_report")
-
-            for report in validation_reports:
-                validator.save_validation_report(report, report_dir)
+        # With --batch, small files are grouped so each group costs a single API call
+        if args.batch:
+            batches = generator.plan_batches(
+                [file_path for file_path in c_files if os.path.basename(file_path) not in args.output_locks]
+            )
+            batches.extend(
+                [file_path] for file_path in c_files if os.path.basename(file_path) in args.output_locks
+            )
+        else:
+            batches = [[file_path] for file_path in c_files]
+
+        executor = ThreadPoolExecutor(max_workers=max(1, args.jobs))
+        futures = [
+            executor.submit(
+                _process_batch, batch, generator, validator, args, output_dir, dependency_map,
+                threshold_quality_level
+            )
+            for batch in batches
+        ]
+        try:
+            for future in as_completed(futures):
+                for final_result, final_validation, regenerations, attempt, lines in future.result():
+                    sys.stdout.write('\n'.join(lines) + '\n')
+                    regeneration_stats['total_regenerations'] += regenerations
+
+                    if final_result and final_result.get('skipped') == 'source too large':
+                        # Not generated, so it still counts as a failure for the exit code
+                        too_large_files += 1
+                    elif final_result and final_result.get('skipped'):
+                        # Nothing to test in this file - neither a generation nor a failure
+                        skipped_files += 1
+                    elif final_result and final_result['success']:
+                        successful_generations += 1
+                        # Save the report as soon as it is produced; keep only what the summary needs
+                        validator.save_validation_report(final_validation, compilation_report_dir)
+                        saved_reports += 1
+                        if _QUALITY_LEVELS.get(final_validation['quality'].lower(), 0) < threshold_quality_level:
+                            low_quality_tests.append(final_validation['file'])
+
+                        # Track successful regenerations
+                        if attempt > 1:
+                            regeneration_stats['successful_regenerations'] += 1
+        except KeyboardInterrupt:
+            # Drop queued work and stop in-flight workers at their next check; a call that is
+            # already running finishes, but its response is discarded
+            args.stop_event.set()
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=False)
 
         # Print summary
         print(f"\n🎉 COMPLETED!")
-        print(f"   Generated: {successful_generations}/{len(c_files)} files")
+        files_to_generate = len(c_files) - skipped_files
+        print(f"   Generated: {successful_generations}/{files_to_generate} files")
+        if skipped_files:
+            print(f"   Skipped: {skipped_files} file(s) with nothing to test")
+        if too_large_files:
+            print(f"   Too large: {too_large_files} source file(s) over {MAX_SOURCE_BYTES} bytes, no tests generated")
         print(f"   Tests saved to: {output_dir}")
-        if validation_reports:
+        if saved_reports:
             print(f"   Reports saved to: {os.path.join(args.output, 'compilation_report')}")
 
         # Print regeneration statistics
@@ -339,26 +529,7 @@ def main():
                 success_rate = (regeneration_stats['successful_regenerations'] / regeneration_stats['total_regenerations']) * 100
                 print(f"   Regeneration success rate: {success_rate:.1f}%")
 
-        # Check quality of all generated tests
-        quality_levels = {'low': 0, 'medium': 1, 'high': 2}
-        threshold_quality_level = quality_levels.get(args.quality_threshold.lower(), 2)
-
-        low_quality_tests = []
-        for report in validation_reports:
-            current_quality_level = quality_levels.get(report['quality'].lower(), 0)
-            if current_quality_level < threshold_quality_level:
-                low_quality_tests.append(report['file'])
-
-        # Check quality of all generated tests
-        quality_levels = {'low': 0, 'medium': 1, 'high': 2}
-        threshold_quality_level = quality_levels.get(args.quality_threshold.lower(), 2)
-
-        low_quality_tests = []
-        for report in validation_reports:
-            current_quality_level = quality_levels.get(report['quality'].lower(), 0)
-            if current_quality_level < threshold_quality_level:
-                low_quality_tests.append(report['file'])
-
+        # Report generated tests below the quality threshold (collected while processing)
         if low_quality_tests:
             if args.regenerate_on_low_quality:
                 # When regeneration is enabled, warn but don't fail
@@ -375,10 +546,10 @@ def main():
                 sys.exit(1)
 
         # Overall success check
-        if successful_generations == 0:
+        if successful_generations == 0 and files_to_generate:
             print("❌ No tests were successfully generated")
             sys.exit(1)
-        elif successful_generations < len(c_files):
+        elif successful_generations < files_to_generate:
             print("⚠️ Some files failed to generate tests - check validation reports")
             sys.exit(1)
 
@@ -4,21 +4,83 @@ Test Validator - Validates generated test files
 
 import os
 import re
-from typing import Dict, List
-
-from .analyzer import DependencyAnalyzer
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Set
+
+from .analyzer import MAX_SOURCE_BYTES, DependencyAnalyzer
+
+# Common standard C library headers that are acceptable in tests
+_STANDARD_HEADERS = frozenset({
+    'stdio.h', 'stdlib.h', 'string.h', 'math.h', 'assert.h', 'ctype.h', 'errno.h',
+    'limits.h', 'stdarg.h', 'stddef.h', 'stdint.h', 'stdbool.h', 'time.h',
+})
+
+# Headers a test may always include
+_ALLOWED_TEST_HEADERS = _STANDARD_HEADERS | {'unity.h'}
+
+# Precompiled patterns used by the validation checks
+_INCLUDE_RE = re.compile(r'#include\s+["<]([^">]+)[">]')
+_FUNC_DEF_RE = re.compile(r'(\w+)\s+(\w+)\s*\([^)]*\)\s*\{')
+_MAIN_CALL_RE = re.compile(r'\bmain\s*\([^)]*\)\s*;')
+_EXTERN_MAIN_RE = re.compile(r'extern\s+int\s+main\s*\(\s*void\s*\)\s*;')
+# Impossible test values, matched in one pass over the whole file. The NULL check is a
+# lookahead so it only consumes "NULL" and cannot hide other hits later on the same line.
+_IMPOSSIBLE_RE = re.compile(
+    r'(?P<absz>-?273\.15f?)'
+    r'|(?P<big>1e10+)'
+    r'|(?P<null>NULL(?=.*=.*[^=!\n].*NULL))'
+)
+# Issue text per group, in the order issues are reported for a line
+_IMPOSSIBLE_DESCRIPTIONS = {
+    'absz': 'Absolute zero temperature test - physically impossible',
+    'big': 'Extremely large values that may cause overflow',
+    'null': 'Testing NULL assignments that may crash',
+}
+_IMPOSSIBLE_ORDER = {kind: index for index, kind in enumerate(_IMPOSSIBLE_DESCRIPTIONS)}
+_FLOAT_WITHIN_RE = re.compile(r'TEST_ASSERT_FLOAT_WITHIN\s*\([^)]+\)')
+_FLOAT_EQ_RE = re.compile(r'TEST_ASSERT_EQUAL_FLOAT\s*\([^)]+\)')
+# Temperature value patterns, each paired with a literal every match contains - a pattern
+# whose literal is absent cannot match, so its scan is skipped
+_TEMP_VALUE_RES = [
+    ('return_value', re.compile(r'return_value\s*=\s*(\d+\.?\d*)f?')),  # stub return values
+    ('TEST_ASSERT_FLOAT_WITHIN', re.compile(r'TEST_ASSERT_FLOAT_WITHIN\s*\([^,]+,\s*(\d+\.?\d*)f?')),  # float assertions
+    ('temp', re.compile(r'(\d+\.?\d*)f?\s*,\s*temp')),  # temperature parameters
+]
+_STUB_VAR_RE = re.compile(r'static\s+\w+\s+g_\w+;')
+_TEARDOWN_RE = re.compile(r'void tearDown\(void\)\s*{([^}]*)}', re.DOTALL)
+_RESET_ASSIGN_RE = re.compile(r'\w+\s*=\s*(0|0\.0f|NULL|false|"DEFAULT");')
+_TEST_HEADER_RE = re.compile(r'void\s+(test_\w+)\s*\(')
+# TEST_ASSERT_TRUE/FALSE with a complete argument list; groups are the kind and the argument
+_TF_ASSERT_RE = re.compile(r'TEST_ASSERT_(TRUE|FALSE)\s*\(\s*([^)]+)\)')
+_EQUAL_RE = re.compile(r'TEST_ASSERT_EQUAL\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)')
+
+# Test files larger than this are rejected without being scanned (runaway generations); the
+# source limit is MAX_SOURCE_BYTES, shared with the generator
+_MAX_TEST_BYTES = 256 * 1024
 
 
 class TestValidator:
     """Universal C Test File Validator - Repo Independent"""
 
-    def __init__(self, repo_path: str):
+    def __init__(self, repo_path: str, max_bytes: int = _MAX_TEST_BYTES):
         self.repo_path = repo_path
+        self.max_bytes = max_bytes
         self.analyzer = DependencyAnalyzer(repo_path)
+        # (source path, st_mtime_ns) -> (functions, allowed test includes, functions by name),
+        # shared by every test validated against that source
+        self._source_cache = {}
+        # Report directories already created by this validator
+        self._ensured_dirs = set()
 
-    def validate_test_file(self, test_file_path: str, source_file_path: str) -> Dict:
+    def validate_test_file(self, test_file_path: str, source_file_path: str, fast_fail: bool = False) -> Dict:
         """
         Validate a generated test file against its source file using comprehensive criteria
+
+        With fast_fail, a file that already fails the compilation checks is rated without running
+        the remaining phases - it is rated Low either way. Its 'realistic' is then None (not
+        checked) and its issues cover compilation only, so leave fast_fail off when the issues
+        feed a regeneration.
         """
         validation_result = {
             'file': os.path.basename(test_file_path),
@@ -32,24 +94,42 @@ class TestValidator:
         }
 
         try:
-            # Read both files
-            with open(test_file_path, 'r') as f:
-                test_content = f.read()
-            with open(source_file_path, 'r') as f:
-                source_content = f.read()
+            # Reject oversized files before any read or scan - they are rated Low either way
+            for kind, path, limit in (
+                ('Test', test_file_path, self.max_bytes),
+                ('Source', source_file_path, MAX_SOURCE_BYTES),
+            ):
+                size = os.stat(path).st_size
+                if size > limit:
+                    validation_result['issues'].append(f"{kind} file too large: {size} bytes (limit {limit})")
+                    validation_result['compiles'] = False
+                    validation_result['quality'] = 'Low'
+                    return validation_result
+
+            # Read the test in one call; the source is only needed through its cached analysis
+            test_content = Path(test_file_path).read_bytes().decode('utf-8', 'replace')
+            if '\r' in test_content:
+                test_content = test_content.replace('\r\n', '\n')
 
             # Extract source function signatures
-            source_functions = self.analyzer._extract_functions(source_file_path)
-            source_includes = self.analyzer._extract_includes(source_file_path)
+            source_functions, allowed_includes, source_by_name = self._get_source_info(source_file_path)
+
+            # Function definitions in the test, shared by the checks below
+            test_functions = self._extract_test_functions(test_content)
 
             # 1. COMPILATION SAFETY CHECKS
-            self._check_compilation_safety(test_content, source_functions, source_includes, validation_result)
+            self._check_compilation_safety(test_content, test_functions, allowed_includes, source_by_name, validation_result)
+
+            if fast_fail and not validation_result['compiles']:
+                validation_result['realistic'] = None
+                validation_result['quality'] = self._calculate_quality_rating(validation_result)
+                return validation_result
 
             # 2. REALITY CHECKS
             self._check_reality_tests(test_content, source_functions, validation_result)
 
             # 3. TEST QUALITY ASSESSMENT
-            self._assess_test_quality(test_content, source_functions, validation_result)
+            self._assess_test_quality(test_content, test_functions, source_functions, validation_result)
 
             # 4. LOGICAL CONSISTENCY VERIFICATION
             self._verify_logical_consistency(test_content, validation_result)
@@ -64,7 +144,27 @@ class TestValidator:
 
         return validation_result
 
-    def _check_compilation_safety(self, test_content: str, source_functions: List[Dict], source_includes: List[str], result: Dict):
+    def _get_source_info(self, source_file_path: str):
+        """
+        Return (functions, allowed_includes, functions_by_name) for a source file, parsing it
+        again only after it changes
+
+        allowed_includes and functions_by_name depend only on the source, so they are built here
+        once instead of by every compilation check against it.
+        """
+        key = (source_file_path, os.stat(source_file_path).st_mtime_ns)
+        info = self._source_cache.get(key)
+        if info is None:
+            functions = self.analyzer._extract_functions(source_file_path)
+            includes = self.analyzer._extract_includes(source_file_path)
+            # Allow unity.h, standard library headers, and headers from source - by full include
+            # path or by file name (a test may include "sensor.h" for the source's "drivers/sensor.h")
+            allowed_includes = _ALLOWED_TEST_HEADERS.union(includes, map(os.path.basename, includes))
+            info = (functions, allowed_includes, {f['name']: f for f in functions})
+            self._source_cache[key] = info
+        return info
+
+    def _check_compilation_safety(self, test_content: str, test_functions: List[Dict], allowed_includes: Set[str], source_by_name: Dict[str, Dict], result: Dict):
         """Check compilation safety criteria"""
 
         # Check for markdown markers (should be removed by post-processing)
@@ -72,59 +172,43 @@ class TestValidator:
             result['issues'].append("Found markdown code block markers (```) - should be removed")
             result['compiles'] = False
 
-        # Check for required includes
-        required_includes = ['unity.h'] + [f"{func['name']}.h" for func in source_functions if func['name'] != 'main']
-        for include in required_includes:
-            if f'#include "{include}"' not in test_content and f'#include <{include}>' not in test_content:
-                if include == 'unity.h':
-                    result['issues'].append(f"Missing required Unity include: #include \"unity.h\"")
-                    result['compiles'] = False
+        # Check for the required Unity include (per-function headers are not required)
+        if '#include "unity.h"' not in test_content and '#include <unity.h>' not in test_content:
+            result['issues'].append(f"Missing required Unity include: #include \"unity.h\"")
+            result['compiles'] = False
 
         # Check for invalid includes (headers that don't exist)
-        invalid_includes = []
-        include_pattern = re.compile(r'#include\s+["<]([^">]+)[">]')
-        # Common standard C library headers that are acceptable in tests
-        standard_headers = {'stdio.h', 'stdlib.h', 'string.h', 'math.h', 'assert.h', 'ctype.h', 'errno.h', 'limits.h', 'stdarg.h', 'stddef.h', 'stdint.h', 'stdbool.h', 'time.h'}
-        
-        for match in include_pattern.finditer(test_content):
-            header = match.group(1)
-            # Allow unity.h, standard library headers, and headers from source
-            if header != 'unity.h' and header not in standard_headers and header not in source_includes:
-                # Check if it's a valid header file that should exist
-                if not any(header in inc for inc in source_includes):
-                    invalid_includes.append(header)
+        invalid_includes = [
+            header for header in _INCLUDE_RE.findall(test_content) if header not in allowed_includes
+        ]
 
         if invalid_includes:
             result['issues'].append(f"Invalid includes for non-existent headers: {invalid_includes}")
             result['compiles'] = False
 
         # Check function signature matches
-        test_functions = self._extract_test_functions(test_content)
-        for test_func in test_functions:
-            if 'test_' in test_func['name']:
-                # Check if stub functions match source signatures
-                stub_matches = re.findall(r'(\w+)\s+(\w+)\s*\([^)]*\)\s*\{', test_content)
-                for return_type, func_name in stub_matches:
-                    # Find matching source function
-                    source_match = next((f for f in source_functions if f['name'] == func_name), None)
-                    if source_match and source_match['return_type'] != return_type:
-                        result['issues'].append(f"Stub function {func_name} return type mismatch: {return_type} vs {source_match['return_type']}")
-                        result['compiles'] = False
+        if any('test_' in test_func['name'] for test_func in test_functions):
+            # Check if stub functions match source signatures (the definitions are the ones
+            # already extracted as test_functions)
+            for stub in test_functions:
+                source_match = source_by_name.get(stub['name'])
+                if source_match and source_match['return_type'] != stub['return_type']:
+                    result['issues'].append(f"Stub function {stub['name']} return type mismatch: {stub['return_type']} vs {source_match['return_type']}")
+                    result['compiles'] = False
 
         # Check for duplicate symbols
-        function_names = [f['name'] for f in test_functions]
-        if len(function_names) != len(set(function_names)):
-            duplicates = [name for name in function_names if function_names.count(name) > 1]
+        duplicates = [name for name, count in Counter(f['name'] for f in test_functions).items() if count > 1]
+        if duplicates:
             result['issues'].append(f"Duplicate function definitions: {duplicates}")
             result['compiles'] = False
 
         # Check for invalid function calls (like main()) - but allow if main() is simple and testable
         # Only flag actual calls to main(), not the test runner's main() function definition
-        main_calls = re.findall(r'\bmain\s*\([^)]*\)\s*;', test_content)
+        main_calls = _MAIN_CALL_RE.findall(test_content)
         if main_calls:
             # Allow main() testing if it's declared as extern and called like a regular function
             # This is acceptable for simple main functions that don't have complex setup
-            if not re.search(r'extern\s+int\s+main\s*\(\s*void\s*\)\s*;', test_content):
+            if not _EXTERN_MAIN_RE.search(test_content):
                 result['issues'].append("Invalid call to main() function - not suitable for unit testing")
                 result['compiles'] = False
 
@@ -136,23 +220,24 @@ class TestValidator:
             result['issues'].append("TEST_ASSERT_EQUAL_FLOAT used - will fail due to precision. Use TEST_ASSERT_FLOAT_WITHIN instead")
             result['realistic'] = False
 
-        # Check for impossible test values
-        impossible_patterns = [
-            (r'-?273\.15f?', 'Absolute zero temperature test - physically impossible'),
-            (r'1e10+', 'Extremely large values that may cause overflow'),
-            (r'NULL.*=.*[^=!].*NULL', 'Testing NULL assignments that may crash'),
-        ]
-
-        lines = test_content.split('\n')
-        for i, line in enumerate(lines, 1):
-            for pattern, description in impossible_patterns:
-                if re.search(pattern, line):
-                    result['issues'].append(f"Line {i}: {description} - unrealistic test scenario")
-                    result['realistic'] = False
+        # Check for impossible test values - one report per line and kind, counting lines
+        # incrementally since matches arrive in order
+        hits = set()
+        line_no = 1
+        last_pos = 0
+        for match in _IMPOSSIBLE_RE.finditer(test_content):
+            line_no += test_content.count('\n', last_pos, match.start())
+            last_pos = match.start()
+            kind = match.lastgroup
+            hits.add((line_no, _IMPOSSIBLE_ORDER[kind], kind))
+
+        for line_no, _, kind in sorted(hits):
+            result['issues'].append(f"Line {line_no}: {_IMPOSSIBLE_DESCRIPTIONS[kind]} - unrealistic test scenario")
+            result['realistic'] = False
 
         # Check floating point comparisons have tolerance - only for actual assertions
-        float_assertions = re.findall(r'TEST_ASSERT_FLOAT_WITHIN\s*\([^)]+\)', test_content)
-        float_equal_assertions = re.findall(r'TEST_ASSERT_EQUAL_FLOAT\s*\([^)]+\)', test_content)
+        float_assertions = _FLOAT_WITHIN_RE.findall(test_content)
+        float_equal_assertions = _FLOAT_EQ_RE.findall(test_content)
 
         # Only flag if there are float equality assertions without tolerance
         if float_equal_assertions and not float_assertions:
@@ -160,46 +245,40 @@ class TestValidator:
             result['realistic'] = False
 
         # Check stub return types match expected ranges - be more specific about context
-        if 'temperature' in test_content.lower() or 'celsius' in test_content.lower():
+        lowered = test_content.lower()
+        if 'temperature' in lowered or 'celsius' in lowered:
             # Temperature should be reasonable range for the specific sensor
-            # Look for actual temperature assignments, not raw ADC values
-            temp_assignment_patterns = [
-                r'return_value\s*=\s*(\d+\.?\d*)f?',  # stub return values
-                r'TEST_ASSERT_FLOAT_WITHIN\s*\([^,]+,\s*(\d+\.?\d*)f?',  # float assertions
-                r'(\d+\.?\d*)f?\s*,\s*temp',  # temperature parameters
-            ]
-
-            for pattern in temp_assignment_patterns:
-                matches = re.findall(pattern, test_content)
-                for val in matches:
-                    try:
-                        temp = float(val)
-                        # Skip validation for raw ADC values (0-1023 range) that are clearly for rand() stubs
-                        if temp >= 0 and temp <= 1023:
-                            # Check if this is clearly a raw ADC value by looking at context
-                            line_context = ""
-                            for line in test_content.split('\n'):
-                                if val in line and ('rand' in line.lower() or 'stub_rand' in line or 'return_value' in line):
-                                    line_context = line.lower()
-                                    break
-
-                            if 'rand' in line_context or 'stub_rand' in line_context or 'return_value' in line_context:
-                                continue  # This is a raw ADC value for rand(), not a temperature
-
-                        # Validate temperature ranges
-                        if temp > 200.0:  # Definitely too high for temperature
-                            result['issues'].append(f"Temperature value {temp} seems unreasonably high (valid range: -40°C to 125°C)")
-                            result['realistic'] = False
-                        elif temp < -100.0:  # Definitely too low for temperature
-                            result['issues'].append(f"Temperature value {temp} seems unreasonably low (valid range: -40°C to 125°C)")
-                            result['realistic'] = False
-                    except ValueError:
-                        pass
-
-    def _assess_test_quality(self, test_content: str, source_functions: List[Dict], result: Dict):
+            # Look for actual temperature assignments, not raw ADC values. Lines mentioning
+            # rand() or a stub return_value mark a value on them as a raw ADC reading.
+            raw_context_lines = [line for line in test_content.split('\n') if 'return_value' in line or 'rand' in line.lower()]
+            raw_values = {}
+
+            for literal, pattern in _TEMP_VALUE_RES:
+                if literal not in test_content:
+                    continue
+                for val in pattern.findall(test_content):
+                    # The patterns only capture digits with an optional decimal point
+                    temp = float(val)
+
+                    # Skip validation for raw ADC values (0-1023 range) that are clearly for rand() stubs
+                    if temp <= 1023:
+                        is_raw = raw_values.get(val)
+                        if is_raw is None:
+                            is_raw = raw_values[val] = any(val in line for line in raw_context_lines)
+                        if is_raw:
+                            continue  # This is a raw ADC value for rand(), not a temperature
+
+                    # Validate temperature ranges
+                    if temp > 200.0:  # Definitely too high for temperature
+                        result['issues'].append(f"Temperature value {temp} seems unreasonably high (valid range: -40°C to 125°C)")
+                        result['realistic'] = False
+                    elif temp < -100.0:  # Definitely too low for temperature
+                        result['issues'].append(f"Temperature value {temp} seems unreasonably low (valid range: -40°C to 125°C)")
+                        result['realistic'] = False
+
+    def _assess_test_quality(self, test_content: str, test_functions: List[Dict], source_functions: List[Dict], result: Dict):
         """Assess test quality criteria"""
 
-        test_functions = self._extract_test_functions(test_content)
         test_names = [f['name'] for f in test_functions if f['name'].startswith('test_')]
 
         # Check for edge cases
@@ -220,18 +299,18 @@ class TestValidator:
         if has_setup and has_teardown:
             # Check if there are stub variables that need resetting
             # Stub variables typically start with 'g_' and are used for call counts/return values
-            stub_variables = re.findall(r'static\s+\w+\s+g_\w+;', test_content)
+            stub_variables = _STUB_VAR_RE.findall(test_content)
             
             if stub_variables:  # Only require tearDown resets if there are actual stub variables
                 # Verify stubs are reset - check for either reset functions or direct variable resets
                 has_reset_functions = 'reset_' in test_content
                 # Check for direct variable resets in tearDown (e.g., var_name = 0)
-                teardown_section = re.search(r'void tearDown\(void\)\s*{([^}]*)}', test_content, re.DOTALL)
+                teardown_section = _TEARDOWN_RE.search(test_content)
                 has_direct_resets = False
                 if teardown_section:
                     teardown_content = teardown_section.group(1)
                     # Look for variable assignments to 0, 0.0f, NULL, etc.
-                    has_direct_resets = bool(re.search(r'\w+\s*=\s*(0|0\.0f|NULL|false|"DEFAULT");', teardown_content))
+                    has_direct_resets = bool(_RESET_ASSIGN_RE.search(teardown_content))
 
                 if not has_reset_functions and not has_direct_resets:
                     result['issues'].append("tearDown() function should reset stub variables (call counts and return values)")
@@ -250,33 +329,27 @@ class TestValidator:
     def _verify_logical_consistency(self, test_content: str, result: Dict):
         """Verify logical consistency"""
 
-        # Check for contradictory assertions in the same test
-        test_sections = re.split(r'void test_\w+\s*\(', test_content)[1:]  # Split by test functions
-
-        for i, section in enumerate(test_sections):
-            test_name = f"test_{i+1}"  # Approximate name
-            assertions = re.findall(r'TEST_ASSERT_\w+\s*\([^)]+\)', section)
+        # Check for contradictory assertions in the same test; each test's section runs from
+        # its header to the next test header
+        headers = list(_TEST_HEADER_RE.finditer(test_content))
 
-            # Check for contradictory boolean assertions
-            true_asserts = [a for a in assertions if 'TEST_ASSERT_TRUE' in a]
-            false_asserts = [a for a in assertions if 'TEST_ASSERT_FALSE' in a]
+        for i, header in enumerate(headers):
+            test_name = header.group(1)
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(test_content)
 
-            if true_asserts and false_asserts:
-                # Check if they're testing different variables
-                true_vars = [re.search(r'TEST_ASSERT_TRUE\s*\(\s*([^)]+)', a) for a in true_asserts]
-                false_vars = [re.search(r'TEST_ASSERT_FALSE\s*\(\s*([^)]+)', a) for a in false_asserts]
+            # Check for contradictory boolean assertions, bucketing asserted expressions by kind
+            true_vars = set()
+            false_vars = set()
+            for match in _TF_ASSERT_RE.finditer(test_content, header.end(), end):
+                (true_vars if match.group(1) == 'TRUE' else false_vars).add(match.group(2).strip())
 
-                if true_vars and false_vars:
-                    true_var_names = [match.group(1).strip() if match else "" for match in true_vars]
-                    false_var_names = [match.group(1).strip() if match else "" for match in false_vars]
-
-                    # If same variable has both TRUE and FALSE assertions, that's suspicious
-                    common_vars = set(true_var_names) & set(false_var_names)
-                    if common_vars:
-                        result['issues'].append(f"Test {test_name}: contradictory assertions for variables {common_vars}")
+            # If same variable has both TRUE and FALSE assertions, that's suspicious
+            common_vars = true_vars & false_vars
+            if common_vars:
+                result['issues'].append(f"Test {test_name}: contradictory assertions for variables {common_vars}")
 
         # Check for reasonable assertion values
-        equal_assertions = re.findall(r'TEST_ASSERT_EQUAL\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)', test_content)
+        equal_assertions = _EQUAL_RE.findall(test_content)
         for expected, actual in equal_assertions:
             # Check for obviously wrong assertions like TEST_ASSERT_EQUAL(1, 2)
             try:
@@ -302,8 +375,7 @@ class TestValidator:
         """Extract test function definitions from test content"""
         functions = []
         # Match function definitions
-        func_pattern = r'(\w+)\s+(\w+)\s*\([^)]*\)\s*{'
-        matches = re.findall(func_pattern, content)
+        matches = _FUNC_DEF_RE.findall(content)
 
         for return_type, func_name in matches:
             functions.append({
@@ -318,7 +390,8 @@ class TestValidator:
         print(f"\n📋 {report['file']}")
         print(f"   Quality: {report['quality']}")
         print(f"   Compiles: {'✅' if report['compiles'] else '❌'}")
-        print(f"   Realistic: {'✅' if report['realistic'] else '❌'}")
+        realistic = 'not checked' if report['realistic'] is None else ('✅' if report['realistic'] else '❌')
+        print(f"   Realistic: {realistic}")
 
         if report['issues']:
             print(f"   Issues ({len(report['issues'])}):")
@@ -328,35 +401,29 @@ class TestValidator:
                 print(f"     ... and {len(report['issues']) - 5} more")
 
     def save_validation_report(self, report: Dict, report_dir: str):
-        """Save validation report to file"""
-        os.makedirs(report_dir, exist_ok=True)
+        """Save validation report to file, creating report_dir the first time it is used"""
+        if report_dir not in self._ensured_dirs:
+            os.makedirs(report_dir, exist_ok=True)
+            self._ensured_dirs.add(report_dir)
 
         base_name = os.path.splitext(report['file'])[0]
         compiles_status = "compiles_yes" if report['compiles'] else "compiles_no"
         filename = f"{base_name}_{compiles_status}.txt"
         filepath = os.path.join(report_dir, filename)
 
-        with open(filepath, 'w') as f:
-            f.write(f"Validation Report for {report['file']}\n")
-            f.write(f"Quality: {report['quality']}\n")
-            f.write(f"Compiles: {report['compiles']}\n")
-            f.write(f"Realistic: {report['realistic']}\n")
-            f.write(f"Issues: {len(report['issues'])}\n")
-            f.write("\nIssues:\n")
-            for issue in report['issues']:
-                f.write(f"- {issue}\n")
-
-            if report['keep']:
-                f.write("\nKeep:\n")
-                for item in report['keep']:
-                    f.write(f"- {item}\n")
-
-            if report['fix']:
-                f.write("\nFix:\n")
-                for item in report['fix']:
-                    f.write(f"- {item}\n")
-
-            if report['remove']:
-                f.write("\nRemove:\n")
-                for item in report['remove']:
-                    f.write(f"- {item}\n")
\ No newline at end of file
+        lines = [
+            f"Validation Report for {report['file']}\n",
+            f"Quality: {report['quality']}\n",
+            f"Compiles: {report['compiles']}\n",
+            f"Realistic: {'not checked' if report['realistic'] is None else report['realistic']}\n",
+            f"Issues: {len(report['issues'])}\n",
+            "\nIssues:\n",
+        ]
+        lines.extend(f"- {issue}\n" for issue in report['issues'])
+
+        for section, key in (("Keep", 'keep'), ("Fix", 'fix'), ("Remove", 'remove')):
+            if report[key]:
+                lines.append(f"\n{section}:\n")
+                lines.extend(f"- {item}\n" for item in report[key])
+
+        Path(filepath).write_text(''.join(lines), encoding='utf-8')